@@ -1,151 +1,501 @@
+# SensePath 远程调试日志服务器
+#
+# 运行: python3 LogServer.py
+# 请求处理全部是纯 Python 代码，也可以用 PyPy 运行以获得 JIT 加速: pypy3 LogServer.py
+# （orjson 不支持 PyPy，此时会自动回退到标准库 json）
+
+import collections
+import gzip
 import http.server
 import json
-import socketserver
 import os
-from datetime import datetime
+import queue
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+# 优先使用 orjson（直接输出 bytes，速度更快），未安装时回退到标准库 json
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+except ImportError:
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    loads = json.loads
 
 PORT = 12345
-LOG_FILE = "logs.json"
+LOG_FILE = "logs.jsonl"
+MAX_LOGS = 500 # 保持最近500条
+FLUSH_INTERVAL = 2 # 每2秒把新日志合并写入磁盘一次
+COMPACT_INTERVAL = 5 * 60 # 每5分钟压缩一次磁盘文件
+MAX_WORKERS = 32 # 处理请求的线程池上限
+IDLE_TIMEOUT = 30 # 持久连接空闲超过该秒数即关闭，释放工作线程
+STREAM_KEEPALIVE = 15 # SSE 空闲时发送心跳的间隔（秒）
+STREAM_SEND_TIMEOUT = 5 # 向单个 SSE 客户端写入的超时，防止慢客户端拖住推送线程
+SEND_BUFFER_SIZE = 256 * 1024 # 足够一次写下完整的 /data 响应
+
+# 内存中的日志环形缓冲区，作为唯一数据源
+LOGS = collections.deque(maxlen=MAX_LOGS)
+# do_POST 收到并编码好的 (日志, 编码结果) 先放入队列，由入库线程批量处理
+INBOX = queue.Queue()
+# 尚未写入磁盘的日志行，由写盘线程批量取走
+PENDING = []
+# 退出时通知写盘线程停止，之后由主线程写入最后一批
+WRITER_STOP = threading.Event()
+# 保护 LOGS、CACHED_BYTES 和 PENDING，请求在多个线程中并发处理
+LOCK = threading.Lock()
+# 有新日志时通知所有 /stream 连接
+NEW_LOG = threading.Condition(LOCK)
+# 单调递增的日志序号，写入每条日志的 seq 字段，客户端据此只拉取增量
+LOG_SEQ = 0
+# 已交给推送线程的 /stream 连接 -> 该连接已收到的最大 seq（-1 表示尚未发送历史）
+STREAMS = {}
+
+# 日志文件只打开一次：启动时从头读取恢复日志，之后由写盘线程独占追加，
+# 追加模式保证每次写入都落在文件末尾，与读取位置无关
+LOG_FP = open(LOG_FILE, 'a+b')
+LOG_FP.seek(0)
+for line in LOG_FP:
+    line = line.strip()
+    if not line:
+        continue
+    try:
+        log = loads(line)
+    except ValueError:
+        continue
+    LOG_SEQ += 1
+    log['seq'] = LOG_SEQ
+    LOGS.append(log)
+
+# /data 响应体的可变版本 "[rec0,rec1,...]"，每条新日志只编码它自己，再拼接进来
+ENCODED = [dumps(log) for log in LOGS]
+CACHED_BUF = bytearray(b"[" + b",".join(ENCODED) + b"]")
+# CACHED_BUF 中每条日志编码后的字节长度，与 LOGS 一一对应，用于删除最旧的一条
+CACHED_LENGTHS = collections.deque(len(e) for e in ENCODED)
+del ENCODED
+
+# 预先编码好的 /data 响应体，仅在收到新日志时从 CACHED_BUF 复制一份。
+# 这是不可变的 bytes，所有请求共享同一份，wfile 无缓冲，直接交给 socket 发送，
+# 因此 /data 不需要再用文件或 mmap 作为中转
+CACHED_BYTES = bytes(CACHED_BUF)
+# CACHED_BYTES 的 gzip 版本，首次被请求时压缩，收到新日志后失效
+CACHED_BYTES_GZ = None
+
+def append_cached(encoded):
+    """把一条已编码的日志拼接到 CACHED_BUF 末尾（需持有 LOCK），缓冲区满时删除最旧的一条"""
+    if len(CACHED_LENGTHS) == MAX_LOGS:
+        dropped = CACHED_LENGTHS.popleft()
+        # 连同其后的逗号一起删除；若这是唯一一条，后面是 "]"，需要保留
+        del CACHED_BUF[1:1 + dropped + (1 if CACHED_LENGTHS else 0)]
+    if CACHED_LENGTHS:
+        CACHED_BUF[-1:] = b"," + encoded + b"]"
+    else:
+        CACHED_BUF[-1:] = encoded + b"]"
+    CACHED_LENGTHS.append(len(encoded))
+
+def ingest_logs():
+    """唯一的入库线程：一次取走所有积压的日志，整批只复制一次缓存、通知一次"""
+    global CACHED_BYTES, CACHED_BYTES_GZ, LOG_SEQ
+    while True:
+        batch = [INBOX.get()]
+        while True:
+            try:
+                batch.append(INBOX.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            # 只有本线程修改 LOG_SEQ，可以在锁外分配序号。
+            # 记录在 do_POST 中已编码（至少含 timestamp，不会是空对象），这里只需把 seq 拼到末尾
+            seq = LOG_SEQ
+            logs = []
+            encoded = []
+            for log, e in batch:
+                seq += 1
+                log['seq'] = seq
+                logs.append(log)
+                encoded.append(e[:-1] + b',"seq":%d}' % seq)
 
-# 初始化日志文件
-if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, 'w') as f:
-        json.dump([], f)
+            with LOCK:
+                LOG_SEQ = seq
+                LOGS.extend(logs)
+                for e in encoded:
+                    append_cached(e)
+                    PENDING.append(e + b"\n")
+                CACHED_BYTES = bytes(CACHED_BUF)
+                CACHED_BYTES_GZ = None
+                NEW_LOG.notify_all()
+        except Exception as e:
+            # 丢弃这一批，但入库线程必须继续运行
+            print(f"Error ingesting logs: {e}")
+
+def flush_pending():
+    """把 PENDING 中的日志合并为一次追加写入"""
+    with LOCK:
+        data = b"".join(PENDING)
+        PENDING.clear()
+    if data:
+        LOG_FP.write(data)
+        LOG_FP.flush()
+
+def compact_log_file():
+    """将磁盘文件重写为最近 MAX_LOGS 条，写入临时文件后原子替换，避免无限增长"""
+    global LOG_FP
+    with LOCK:
+        snapshot = list(LOGS)
+        # 快照已包含尚未写盘的日志
+        PENDING.clear()
+    tmp_file = LOG_FILE + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(b"".join(dumps(log) + b"\n" for log in snapshot))
+    LOG_FP.close()
+    os.replace(tmp_file, LOG_FILE)
+    LOG_FP = open(LOG_FILE, 'a+b')
+
+def write_logs():
+    """唯一的写盘线程：请求路径上只写内存，磁盘 I/O 在这里批量完成"""
+    last_compact = time.monotonic()
+    while not WRITER_STOP.wait(FLUSH_INTERVAL):
+        try:
+            # 上次压缩若在替换文件途中失败，LOG_FP 已关闭，需要重新压缩来重新打开
+            if LOG_FP.closed or time.monotonic() - last_compact >= COMPACT_INTERVAL:
+                compact_log_file()
+                last_compact = time.monotonic()
+            else:
+                flush_pending()
+        except (OSError, ValueError) as e:
+            # 例如磁盘已满：这一批日志只保留在内存中，写盘线程继续运行
+            print(f"Error writing logs: {e}")
+
+# 最近一次格式化的 (秒, "HH:MM:SS")，同一秒内的日志只需拼接毫秒
+TS_CACHE = (None, "")
+
+def format_timestamp():
+    """返回本地时间 HH:MM:SS.mmm，避免每条日志都构造 datetime 并解析格式串"""
+    global TS_CACHE
+    t = time.time()
+    sec = int(t)
+    cached_sec, prefix = TS_CACHE
+    if sec != cached_sec:
+        prefix = time.strftime("%H:%M:%S", time.localtime(sec))
+        TS_CACHE = (sec, prefix)
+    return f"{prefix}.{int((t - sec) * 1000):03d}"
+
+def logs_since(since):
+    """返回 seq 大于 since 的日志（需持有 LOCK），从右侧扫描，通常只需 1-2 次迭代"""
+    if since > LOG_SEQ:
+        # 服务器重启后序号重新开始，客户端需要完整数据
+        since = 0
+    delta = []
+    for log in reversed(LOGS):
+        if log['seq'] <= since:
+            break
+        delta.append(log)
+    delta.reverse()
+    return delta
+
+def close_stream(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+def broadcast_logs():
+    """由单个线程向所有 /stream 连接推送新日志，连接本身不占用线程池的工作线程"""
+    while True:
+        with NEW_LOG:
+            # 检查条件而不是单纯等待通知：推送期间（锁外）到达的 notify_all 不会丢失
+            changed = NEW_LOG.wait_for(lambda: any(s != LOG_SEQ for s in STREAMS.values()),
+                                       timeout=STREAM_KEEPALIVE)
+            # 已收到相同 seq 的连接共享同一份增量；超时则向所有连接发送心跳
+            deltas = {}
+            pending = []
+            for sock, seen in STREAMS.items():
+                if seen != LOG_SEQ:
+                    if seen not in deltas:
+                        deltas[seen] = logs_since(seen)
+                elif changed:
+                    continue
+                else:
+                    deltas[seen] = None
+                pending.append((sock, seen))
+                STREAMS[sock] = LOG_SEQ
+            seq = LOG_SEQ
+
+        # 在锁外编码和写出，避免阻塞 do_POST
+        frames = {}
+        for seen, delta in deltas.items():
+            if delta is None:
+                # 心跳，顺便检测客户端是否已断开
+                frames[seen] = b': keepalive\n\n'
+            else:
+                frames[seen] = b'data: ' + dumps({"seq": seq, "logs": delta}) + b'\n\n'
+        for sock, seen in pending:
+            try:
+                sock.sendall(frames[seen])
+            except OSError:
+                with LOCK:
+                    STREAMS.pop(sock, None)
+                close_stream(sock)
+
+# 监控页面模板，导入时编码一次；__INITIAL__ 处在请求时嵌入当前日志，
+# 页面打开即可渲染，无需等待第一帧数据
+HTML_TEMPLATE = """\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>SensePath Remote Debug Info</title>
+    <style>
+        body { font-family: -apple-system, sans-serif; background: #1a1a1a; color: #eee; margin: 20px; }
+        .card { background: #2a2a2a; border-radius: 12px; padding: 20px; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.3); }
+        .header { display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid #444; padding-bottom: 10px; margin-bottom: 15px; }
+        .status { font-weight: bold; padding: 4px 12px; border-radius: 20px; font-size: 0.9em; }
+        .status-normal { background: #28a745; color: white; }
+        .status-warning { background: #ffc107; color: black; }
+        .status-stop { background: #dc3545; color: white; }
+        .metrics { display: grid; grid-template-columns: repeat(3, 1fr); gap: 10px; }
+        .metric-box { background: #333; padding: 10px; border-radius: 8px; text-align: center; }
+        .metric-label { font-size: 0.8em; color: #888; display: block; }
+        .metric-value { font-size: 1.2em; font-weight: bold; color: #007aff; }
+        .log-area { font-family: monospace; background: #000; padding: 15px; border-radius: 8px; height: 300px; overflow-y: auto; font-size: 0.85em; }
+        .log-entry { margin-bottom: 4px; border-bottom: 1px solid #1a1a1a; padding-bottom: 2px; }
+        .timestamp { color: #666; margin-right: 8px; }
+        .error { color: #ff3b30; }
+    </style>
+    <script>
+        let logs = __INITIAL__.slice(-50);
+        let lastSeq = logs.length > 0 ? logs[logs.length - 1].seq : 0;
+        function render(data) {
+            if (data.length > 0) {
+                const latest = data[data.length - 1];
+                document.getElementById('state').innerText = latest.state;
+                document.getElementById('state').className = 'status status-' + latest.state.toLowerCase();
+                document.getElementById('left').innerText = latest.left.toFixed(2) + 'm';
+                document.getElementById('center').innerText = latest.center.toFixed(2) + 'm';
+                document.getElementById('right').innerText = latest.right.toFixed(2) + 'm';
+                document.getElementById('invalid').innerText = (latest.invalidRatio * 100).toFixed(0) + '%';
+                document.getElementById('stability').innerText = latest.stability.toFixed(2) + 'm';
+                document.getElementById('fps').innerText = latest.fps.toFixed(1);
+                
+                const logList = document.getElementById('log-list');
+                logList.innerHTML = data.slice(-50).reverse().map(log => `
+                    <div class="log-entry">
+                        <span class="timestamp">${log.timestamp}</span>
+                        [${log.state}] L:${log.left.toFixed(2)} C:${log.center.toFixed(2)} R:${log.right.toFixed(2)}
+                    </div>
+                `).join('');
+            }
+        }
+        document.addEventListener('DOMContentLoaded', () => {
+            render(logs);
+            // 服务器在有新日志时主动推送增量，断线后 EventSource 会自动重连
+            const stream = new EventSource('/stream?since=' + lastSeq);
+            stream.onmessage = e => {
+                const frame = JSON.parse(e.data);
+                if (frame.seq < lastSeq) {
+                    // 服务器重启后序号重新开始，收到的是完整历史
+                    logs = [];
+                    lastSeq = 0;
+                }
+                // 原地追加，并只保留最近 50 条，不必每次都复制整个数组
+                for (const log of frame.logs) {
+                    if (log.seq > lastSeq) logs.push(log);
+                }
+                if (logs.length > 50) logs.splice(0, logs.length - 50);
+                lastSeq = frame.seq;
+                render(logs);
+            };
+            stream.onerror = e => console.error("Stream failed", e);
+        });
+    </script>
+</head>
+<body>
+    <h1>SensePath Remote Monitor</h1>
+    <div class="card">
+        <div class="header">
+            <h2>Real-time State</h2>
+            <span id="state" class="status">DETACHED</span>
+        </div>
+        <div class="metrics">
+            <div class="metric-box"><span class="metric-label">Left</span><span class="metric-value" id="left">-</span></div>
+            <div class="metric-box"><span class="metric-label">Center</span><span class="metric-value" id="center">-</span></div>
+            <div class="metric-box"><span class="metric-label">Right</span><span class="metric-value" id="right">-</span></div>
+            <div class="metric-box"><span class="metric-label">Holes</span><span class="metric-value" id="invalid">-</span></div>
+            <div class="metric-box"><span class="metric-label">Jitter</span><span class="metric-value" id="stability">-</span></div>
+            <div class="metric-box"><span class="metric-label">FPS</span><span class="metric-value" id="fps">-</span></div>
+        </div>
+    </div>
+    <h3>Activity Logs</h3>
+    <div class="log-area" id="log-list">
+        Waiting for data...
+    </div>
+</body>
+</html>
+""".encode('utf-8')
+HTML_HEAD, HTML_TAIL = HTML_TEMPLATE.split(b'__INITIAL__')
+
+# 常用响应头预先编码为 bytes，热路径上与状态行、响应体一起一次写出
+COMMON_HEADERS = b"Access-Control-Allow-Origin: *\r\n"
+JSON_HEADERS = COMMON_HEADERS + b"Content-Type: application/json\r\n"
+DATA_HEADERS = JSON_HEADERS + b"Vary: Accept-Encoding\r\n"
+DATA_GZ_HEADERS = DATA_HEADERS + b"Content-Encoding: gzip\r\n"
+HTML_HEADERS = COMMON_HEADERS + b"Content-Type: text/html; charset=utf-8\r\n"
+OK_BODY = b'{"status": "ok"}'
 
 class LogRequestHandler(http.server.BaseHTTPRequestHandler):
+    # 使用持久连接，每个客户端的轮询复用同一个 TCP 连接，因此所有响应都必须带 Content-Length
+    protocol_version = "HTTP/1.1"
+    # 空闲的持久连接会一直占用一个工作线程，超时后关闭
+    timeout = IDLE_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        # 小响应立即发出，不等待 Nagle 合并；长连接的 /stream 依赖 keepalive 发现断线
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
+    def query_since(self, url, default):
+        """解析 ?since=<n>，缺省时返回 default；格式错误时回复 400 并返回 None"""
+        query = parse_qs(url.query)
+        if 'since' not in query:
+            return default
+        try:
+            return int(query['since'][0])
+        except ValueError:
+            self.send_error(400, "Invalid since")
+            return None
+
+    def send_body(self, body, headers=JSON_HEADERS):
+        """绕过 send_header，用一次 write 发出 200 状态行、预编码的头部和响应体"""
+        self.log_request(200)
+        self.wfile.write(b"HTTP/1.1 200 OK\r\n" + headers
+                         + b"Content-Length: %d\r\n\r\n" % len(body) + body)
+
     def do_GET(self):
-        if self.path == '/':
+        global CACHED_BYTES_GZ
+        url = urlparse(self.path)
+        if url.path == '/':
+            with LOCK:
+                initial = CACHED_BYTES
+            # JSON 中的 "<" 只会出现在字符串里，转义后不会提前结束 <script>
+            body = HTML_HEAD + initial.replace(b"<", b"\\u003c") + HTML_TAIL
+            self.send_body(body, HTML_HEADERS)
+
+        elif url.path == '/data':
+            since = self.query_since(url, -1)
+            if since is None:
+                return
+            if since >= 0:
+                with LOCK:
+                    seq, delta = LOG_SEQ, logs_since(since)
+                body = dumps({"seq": seq, "logs": delta})
+                self.send_body(body)
+            elif 'gzip' in self.headers.get('Accept-Encoding', ''):
+                # 日志中大量重复的键名压缩率很高，level 1 几乎没有额外开销
+                with LOCK:
+                    if CACHED_BYTES_GZ is None:
+                        CACHED_BYTES_GZ = gzip.compress(CACHED_BYTES, compresslevel=1)
+                    body = CACHED_BYTES_GZ
+                self.send_body(body, DATA_GZ_HEADERS)
+            else:
+                with LOCK:
+                    body = CACHED_BYTES
+                self.send_body(body, DATA_HEADERS)
+
+        elif url.path == '/stream':
+            # 页面已内嵌了 since 之前的日志，只需推送之后的增量
+            since = self.query_since(url, -1)
+            if since is None:
+                return
             self.send_response(200)
             self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-type', 'text/html; charset=utf-8')
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            # 事件流没有长度，以关闭连接作为结束
+            self.send_header('Connection', 'close')
             self.end_headers()
-            
-            html = """
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>SensePath Remote Debug Info</title>
-                <style>
-                    body { font-family: -apple-system, sans-serif; background: #1a1a1a; color: #eee; margin: 20px; }
-                    .card { background: #2a2a2a; border-radius: 12px; padding: 20px; margin-bottom: 20px; box-shadow: 0 4px 6px rgba(0,0,0,0.3); }
-                    .header { display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid #444; padding-bottom: 10px; margin-bottom: 15px; }
-                    .status { font-weight: bold; padding: 4px 12px; border-radius: 20px; font-size: 0.9em; }
-                    .status-normal { background: #28a745; color: white; }
-                    .status-warning { background: #ffc107; color: black; }
-                    .status-stop { background: #dc3545; color: white; }
-                    .metrics { display: grid; grid-template-columns: repeat(3, 1fr); gap: 10px; }
-                    .metric-box { background: #333; padding: 10px; border-radius: 8px; text-align: center; }
-                    .metric-label { font-size: 0.8em; color: #888; display: block; }
-                    .metric-value { font-size: 1.2em; font-weight: bold; color: #007aff; }
-                    .log-area { font-family: monospace; background: #000; padding: 15px; border-radius: 8px; height: 300px; overflow-y: auto; font-size: 0.85em; }
-                    .log-entry { margin-bottom: 4px; border-bottom: 1px solid #1a1a1a; padding-bottom: 2px; }
-                    .timestamp { color: #666; margin-right: 8px; }
-                    .error { color: #ff3b30; }
-                </style>
-                <script>
-                    async function fetchLogs() {
-                        try {
-                            const res = await fetch('/data');
-                            const data = await res.json();
-                            if (data.length > 0) {
-                                const latest = data[data.length - 1];
-                                document.getElementById('state').innerText = latest.state;
-                                document.getElementById('state').className = 'status status-' + latest.state.toLowerCase();
-                                document.getElementById('left').innerText = latest.left.toFixed(2) + 'm';
-                                document.getElementById('center').innerText = latest.center.toFixed(2) + 'm';
-                                document.getElementById('right').innerText = latest.right.toFixed(2) + 'm';
-                                document.getElementById('invalid').innerText = (latest.invalidRatio * 100).toFixed(0) + '%';
-                                document.getElementById('stability').innerText = latest.stability.toFixed(2) + 'm';
-                                document.getElementById('fps').innerText = latest.fps.toFixed(1);
-                                
-                                const logList = document.getElementById('log-list');
-                                logList.innerHTML = data.slice(-50).reverse().map(log => `
-                                    <div class="log-entry">
-                                        <span class="timestamp">${log.timestamp}</span>
-                                        [${log.state}] L:${log.left.toFixed(2)} C:${log.center.toFixed(2)} R:${log.right.toFixed(2)}
-                                    </div>
-                                `).join('');
-                            }
-                        } catch (e) {
-                            console.error("Fetch failed", e);
-                        }
-                    }
-                    setInterval(fetchLogs, 500);
-                </script>
-            </head>
-            <body>
-                <h1>SensePath Remote Monitor</h1>
-                <div class="card">
-                    <div class="header">
-                        <h2>Real-time State</h2>
-                        <span id="state" class="status">DETACHED</span>
-                    </div>
-                    <div class="metrics">
-                        <div class="metric-box"><span class="metric-label">Left</span><span class="metric-value" id="left">-</span></div>
-                        <div class="metric-box"><span class="metric-label">Center</span><span class="metric-value" id="center">-</span></div>
-                        <div class="metric-box"><span class="metric-label">Right</span><span class="metric-value" id="right">-</span></div>
-                        <div class="metric-box"><span class="metric-label">Holes</span><span class="metric-value" id="invalid">-</span></div>
-                        <div class="metric-box"><span class="metric-label">Jitter</span><span class="metric-value" id="stability">-</span></div>
-                        <div class="metric-box"><span class="metric-label">FPS</span><span class="metric-value" id="fps">-</span></div>
-                    </div>
-                </div>
-                <h3>Activity Logs</h3>
-                <div class="log-area" id="log-list">
-                    Waiting for data...
-                </div>
-            </body>
-            </html>
-            """
-            self.wfile.write(html.encode('utf-8'))
-            
-        elif self.path == '/data':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            with open(LOG_FILE, 'r') as f:
-                self.wfile.write(f.read().encode('utf-8'))
-                
+            # 连接交给推送线程，本工作线程立即返回线程池
+            self.connection.settimeout(STREAM_SEND_TIMEOUT)
+            with NEW_LOG:
+                STREAMS[self.connection] = since
+                NEW_LOG.notify_all()
+
+        else:
+            self.send_error(404)
+
     def do_POST(self):
         if self.path == '/log':
             content_length = int(self.headers.get('Content-Length', 0))
             post_data = self.rfile.read(content_length)
             
             try:
-                new_log = json.loads(post_data.decode('utf-8'))
-                new_log['timestamp'] = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-                
-                with open(LOG_FILE, 'r+') as f:
-                    logs = json.load(f)
-                    logs.append(new_log)
-                    if len(logs) > 500: logs = logs[-500:] # 保持最近500条
-                    f.seek(0)
-                    json.dump(logs, f)
-                    f.truncate()
-                
-                self.send_response(200)
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(b'{"status": "ok"}')
+                new_log = loads(post_data)
+                new_log['timestamp'] = format_timestamp()
+                # seq 由入库线程分配
+                new_log.pop('seq', None)
+                # 在这里编码，无法编码的日志（如嵌套过深）直接回复 400
+                INBOX.put((new_log, dumps(new_log)))
+                self.send_body(OK_BODY)
             except Exception as e:
                 print(f"Error processing log: {e}")
+                body = str(e).encode('utf-8')
                 self.send_response(400)
                 self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Content-Length', str(len(body)))
                 self.end_headers()
-                self.wfile.write(str(e).encode('utf-8'))
+                self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+class PooledHTTPServer(http.server.ThreadingHTTPServer):
+    """并发处理请求，但使用固定大小的线程池代替每个请求一个线程"""
+    def __init__(self, *args, **kwargs):
+        self.requests = queue.Queue()
+        # 工作线程设为守护线程：仍阻塞在持久连接读取上时，Ctrl-C 也能让进程退出
+        for _ in range(MAX_WORKERS):
+            threading.Thread(target=self.serve_requests, daemon=True).start()
+        super().__init__(*args, **kwargs)
 
-with socketserver.TCPServer(("", PORT), LogRequestHandler) as httpd:
+    def serve_requests(self):
+        while True:
+            request, client_address = self.requests.get()
+            self.process_request_thread(request, client_address)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def shutdown_request(self, request):
+        # /stream 连接由推送线程负责关闭
+        with LOCK:
+            if request in STREAMS:
+                return
+        super().shutdown_request(request)
+
+threading.Thread(target=ingest_logs, daemon=True).start()
+writer = threading.Thread(target=write_logs, daemon=True)
+writer.start()
+threading.Thread(target=broadcast_logs, daemon=True).start()
+
+with PooledHTTPServer(("", PORT), LogRequestHandler) as httpd:
     print(f"Server started at http://localhost:{PORT}")
     print("CRITICAL: Use HTTP only. HTTPS is NOT supported.")
     # 获取本地 IP
-    import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(('8.8.8.8', 80))
@@ -153,4 +503,10 @@ with socketserver.TCPServer(("", PORT), LogRequestHandler) as httpd:
         print(f"Remote End Point: http://{ip}:{PORT}/log")
     finally:
         s.close()
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        # 先等写盘线程停下，避免与其中的文件替换同时进行，再写入最后一批日志
+        WRITER_STOP.set()
+        writer.join()
+        flush_pending()